@@ -92,6 +92,13 @@ class TestAllBlends(vtk.test.Testing.vtkTest):
         foregrounds = ["luminance", "luminanceAlpha", "color", "colorAlpha"]
         backgrounds = ["backgroundColor", "backgroundLuminance"]
 
+        # map the source names used in the loops below to their objects so
+        # output ports can be looked up directly instead of with eval()
+        sources = {"luminance": luminance, "luminanceAlpha": luminanceAlpha,
+                   "color": color, "colorAlpha": colorAlpha,
+                   "backgroundColor": backgroundColor,
+                   "backgroundLuminance": backgroundLuminance}
+
         deltaX = 1.0 / 4.0
         deltaY = 1.0 / 2.0
 
@@ -102,27 +109,26 @@ class TestAllBlends(vtk.test.Testing.vtkTest):
 
         for row, bg in enumerate(backgrounds):
             for column, fg in enumerate(foregrounds):
-                blend.update({bg:{fg:vtk.vtkImageBlend()}})
-                blend[bg][fg].AddInputConnection(eval(bg + '.GetOutputPort()'))
+                key = (bg, fg)
+                blend[key] = vtk.vtkImageBlend()
+                blend[key].AddInputConnection(sources[bg].GetOutputPort())
                 if bg == "backgroundColor" or fg == "luminance" or fg == "luminanceAlpha":
-                    blend[bg][fg].AddInputConnection(eval(fg + '.GetOutputPort()'))
-                    blend[bg][fg].SetOpacity(1, 0.8)
-
-                mapper.update({bg:{fg:vtk.vtkImageMapper()}})
-                mapper[bg][fg].SetInputConnection(blend[bg][fg].GetOutputPort())
-                mapper[bg][fg].SetColorWindow(255)
-                mapper[bg][fg].SetColorLevel(127.5)
+                    blend[key].AddInputConnection(sources[fg].GetOutputPort())
+                    blend[key].SetOpacity(1, 0.8)
 
-                actor.update({bg:{fg:vtk.vtkActor2D()}})
-                actor[bg][fg].SetMapper(mapper[bg][fg])
+                mapper[key] = vtk.vtkImageMapper()
+                mapper[key].SetInputConnection(blend[key].GetOutputPort())
+                mapper[key].SetColorWindow(255)
+                mapper[key].SetColorLevel(127.5)
 
-                imager.update({bg:{fg:vtk.vtkRenderer()}})
-                imager[bg][fg].AddActor2D(actor[bg][fg])
-                imager[bg][fg].SetViewport(column * deltaX, row * deltaY, (column + 1) * deltaX, (row + 1) * deltaY)
+                actor[key] = vtk.vtkActor2D()
+                actor[key].SetMapper(mapper[key])
 
-                renWin.AddRenderer(imager[bg][fg])
+                imager[key] = vtk.vtkRenderer()
+                imager[key].AddActor2D(actor[key])
+                imager[key].SetViewport(column * deltaX, row * deltaY, (column + 1) * deltaX, (row + 1) * deltaY)
 
-                column += 1
+                renWin.AddRenderer(imager[key])
 
         # render and interact with data
 
@@ -27,12 +27,13 @@ iso.SetInputConnection(v16.GetOutputPort())
 iso.GenerateValues(6, 500, 1150)
 iso.Update()
 
-numPts = iso.GetOutput().GetNumberOfPoints()
+isoOutput = iso.GetOutput()
+numPts = isoOutput.GetNumberOfPoints()
 
 isoMapper = vtk.vtkPolyDataMapper()
 isoMapper.SetInputConnection(iso.GetOutputPort())
 isoMapper.ScalarVisibilityOn()
-isoMapper.SetScalarRange(iso.GetOutput().GetScalarRange())
+isoMapper.SetScalarRange(isoOutput.GetPointData().GetScalars().GetRange())
 isoActor = vtk.vtkActor()
 isoActor.SetMapper(isoMapper)
 
@@ -65,12 +65,24 @@ Created: September, 2002
 Prabhu Ramachandran <prabhu@aero.iitb.ac.in>
 """
 from __future__ import absolute_import
-import sys, os, time
+import sys, os, time, weakref
 import os.path
 import unittest, getopt
 import vtk
 from . import BlackBox
 
+try:
+    # Python 3.3+
+    _process_time = time.process_time
+except AttributeError:
+    # Python 2: clock() is the closest portable CPU-time source.
+    _process_time = time.clock
+
+# default locations used when neither command line args nor
+# environment variables specify them, computed once at import.
+_VTK_DATA_ROOT_DEFAULT = os.path.normpath("../../../../../VTKData")
+_VTK_TEMP_DIR_DEFAULT = os.path.normpath("../../../../Testing/Temporary")
+
 # location of the VTK data files.  Set via command line args or
 # environment variable.
 VTK_DATA_ROOT = ""
@@ -95,6 +107,32 @@ _INTERACT = 0
 # line arguments.
 _NO_IMAGE = 0
 
+# Whether the render window contents have to be grabbed from the front
+# buffer.  None until the first compareImage call probes the back
+# buffer; True or False afterwards so later compares skip the failed
+# back-buffer attempt on systems that do not support it.
+_FRONT_BUFFER_REQUIRED = None
+
+# Number of worker processes used to run the tests.  When greater than
+# 1 and pytest-xdist is available the tests are dispatched to pytest
+# instead of the serial unittest runner.  Set via command line args.
+_JOBS = 1
+
+def _initFromEnvironment():
+    """Seeds the configuration globals from the environment.  Called at
+    import time so that test processes spawned by the parallel runner,
+    which never see the parent's command line, pick up the
+    configuration exported by processCmdLine."""
+    global VTK_DATA_ROOT, VTK_BASELINE_ROOT, VTK_TEMP_DIR, _NO_IMAGE
+    VTK_DATA_ROOT = os.environ.get('VTK_DATA_ROOT', VTK_DATA_ROOT)
+    VTK_BASELINE_ROOT = os.environ.get('VTK_BASELINE_ROOT',
+                                       VTK_BASELINE_ROOT)
+    VTK_TEMP_DIR = os.environ.get('VTK_TEMP_DIR', VTK_TEMP_DIR)
+    if os.environ.get('VTK_TESTING_NO_IMAGE'):
+        _NO_IMAGE = 1
+
+_initFromEnvironment()
+
 def skip():
     '''Cause the test to be skipped due to insufficient requirements.'''
     sys.exit(0)
@@ -161,9 +199,36 @@ def getAbsImagePath(img_basename):
     global VTK_BASELINE_ROOT
     return os.path.join(VTK_BASELINE_ROOT, img_basename)
 
+# Cache for _getTempImagePath results.  Keyed on the temp dir as well
+# as the file name since VTK_TEMP_DIR is only fixed once processCmdLine
+# has run.
+_TEMP_IMAGE_PATH_CACHE = {}
+
 def _getTempImagePath(img_fname):
-    x = os.path.join(VTK_TEMP_DIR, os.path.split(img_fname)[1])
-    return os.path.abspath(x)
+    key = (VTK_TEMP_DIR, img_fname)
+    try:
+        return _TEMP_IMAGE_PATH_CACHE[key]
+    except KeyError:
+        x = os.path.join(VTK_TEMP_DIR, os.path.split(img_fname)[1])
+        x = os.path.abspath(x)
+        _TEMP_IMAGE_PATH_CACHE[key] = x
+        return x
+
+# Decoded baseline images, keyed on (file name, modification time) so
+# that a regenerated baseline invalidates its cached reader.  Suites
+# comparing against the same baseline repeatedly skip the PNG decode.
+_BASELINE_READER_CACHE = {}
+
+def _getBaselineReader(img_fname):
+    key = (img_fname, os.path.getmtime(img_fname))
+    try:
+        return _BASELINE_READER_CACHE[key]
+    except KeyError:
+        pngr = vtk.vtkPNGReader()
+        pngr.SetFileName(img_fname)
+        pngr.Update()
+        _BASELINE_READER_CACHE[key] = pngr
+        return pngr
 
 def compareImageWithSavedImage(src_img, img_fname, threshold=10):
     """Compares a source image (src_img, which is a vtkImageData) with
@@ -190,9 +255,7 @@ def compareImageWithSavedImage(src_img, img_fname, threshold=10):
         sys.tracebacklimit = 0
         raise RuntimeError(msg)
 
-    pngr = vtk.vtkPNGReader()
-    pngr.SetFileName(img_fname)
-    pngr.Update()
+    pngr = _getBaselineReader(img_fname)
 
     idiff = vtk.vtkImageDifference()
     idiff.SetInputConnection(src_img.GetOutputPort())
@@ -214,8 +277,8 @@ def compareImageWithSavedImage(src_img, img_fname, threshold=10):
                 # no other image exists.
                 break
             # since file exists check if it matches.
-            pngr.SetFileName(new_fname)
-            pngr.Update()
+            pngr = _getBaselineReader(new_fname)
+            idiff.SetImageConnection(pngr.GetOutputPort())
             idiff.Update()
             alt_err = idiff.GetThresholdedError()
             if alt_err < threshold:
@@ -246,6 +309,20 @@ def compareImageWithSavedImage(src_img, img_fname, threshold=10):
     _printCDashImageSuccess(img_err, err_index)
 
 
+# One vtkWindowToImageFilter per render window so that repeated
+# compares on the same window do not rebuild the capture pipeline each
+# time.  Weak keys let a filter go away together with its window.
+_W2IF_POOL = weakref.WeakKeyDictionary()
+
+def _getWindowToImageFilter(renwin):
+    try:
+        return _W2IF_POOL[renwin]
+    except KeyError:
+        w2if = vtk.vtkWindowToImageFilter()
+        w2if.SetInput(renwin)
+        _W2IF_POOL[renwin] = w2if
+        return w2if
+
 def compareImage(renwin, img_fname, threshold=10):
     """Compares renwin's (a vtkRenderWindow) contents with the image
     file whose name is given in the second argument.  If the image
@@ -254,18 +331,30 @@ def compareImage(renwin, img_fname, threshold=10):
     This function also handles multiple images and finds the best
     matching image.  """
 
-    global _NO_IMAGE
+    global _NO_IMAGE, _FRONT_BUFFER_REQUIRED
     if _NO_IMAGE:
         return
 
-    w2if = vtk.vtkWindowToImageFilter()
-    w2if.ReadFrontBufferOff()
-    w2if.SetInput(renwin)
-    w2if.Update()
-    try:
-        compareImageWithSavedImage(w2if, img_fname, threshold)
-    except RuntimeError:
+    w2if = _getWindowToImageFilter(renwin)
+    if _FRONT_BUFFER_REQUIRED:
         w2if.ReadFrontBufferOn()
+    else:
+        w2if.ReadFrontBufferOff()
+    # force a fresh grab of the window contents; the window can have
+    # re-rendered without touching the filter's modified time.
+    w2if.Modified()
+    w2if.Update()
+    if _FRONT_BUFFER_REQUIRED is None:
+        # probe the back buffer once; remember the answer so later
+        # compares do not redo the full compare twice.
+        try:
+            compareImageWithSavedImage(w2if, img_fname, threshold)
+            _FRONT_BUFFER_REQUIRED = 0
+        except RuntimeError:
+            _FRONT_BUFFER_REQUIRED = 1
+            w2if.ReadFrontBufferOn()
+            compareImageWithSavedImage(w2if, img_fname, threshold)
+    else:
         compareImageWithSavedImage(w2if, img_fname, threshold)
     return
 
@@ -344,24 +433,24 @@ def main(cases):
 
     processCmdLine()
 
-    timer = vtk.vtkTimerLog()
-    s_time = timer.GetCPUTime()
+    s_time = _process_time()
     s_wall_time = time.time()
 
     # run the tests
     result = test(cases)
 
-    tot_time = timer.GetCPUTime() - s_time
+    tot_time = _process_time() - s_time
     tot_wall_time = float(time.time() - s_wall_time)
 
-    # output measurements for CDash
-    print("<DartMeasurement name=\"WallTime\" type=\"numeric/double\"> "
-          " %f </DartMeasurement>"%tot_wall_time)
-    print("<DartMeasurement name=\"CPUTime\" type=\"numeric/double\"> "
-          " %f </DartMeasurement>"%tot_time)
+    # output measurements for CDash in a single write
+    sys.stdout.write(
+        "<DartMeasurement name=\"WallTime\" type=\"numeric/double\"> "
+        " %f </DartMeasurement>\n"
+        "<DartMeasurement name=\"CPUTime\" type=\"numeric/double\"> "
+        " %f </DartMeasurement>\n"%(tot_wall_time, tot_time))
 
-    # Delete these to eliminate debug leaks warnings.
-    del cases, timer
+    # Delete this to eliminate debug leaks warnings.
+    del cases
 
     if result.wasSuccessful():
         sys.exit(0)
@@ -369,6 +458,12 @@ def main(cases):
         sys.exit(1)
 
 
+# Test case instances already discovered by test(), keyed on the (test
+# case class, method prefix) pair.  Only the instances are cached; a
+# run consumes the TestSuite wrapping them (suites drop their tests as
+# they execute on Python 3.4+), so a fresh suite is built per run.
+_TEST_CASE_CACHE = {}
+
 def test(cases):
     """ Pass a list of tuples containing test classes and the
     functions used for testing.
@@ -380,10 +475,23 @@ def test(cases):
       test = test_suite([(vtkTestClass, 'test'),
                         (vtkTestClass1, 'test')])
     """
-    # Make the test suites from the arguments.
+    if _JOBS > 1:
+        result = _testInParallel(cases)
+        if result is not None:
+            return result
+
+    # Make the test suites from the arguments.  The discovered test
+    # case instances are cached per (class, prefix) pair since finding
+    # them introspects the whole test class; repeated test() calls
+    # reuse them inside a freshly built suite.
     suites = []
     for case in cases:
-        suites.append(unittest.makeSuite(case[0], case[1]))
+        key = (case[0], case[1])
+        tests = _TEST_CASE_CACHE.get(key)
+        if tests is None:
+            tests = tuple(unittest.makeSuite(case[0], case[1]))
+            _TEST_CASE_CACHE[key] = tests
+        suites.append(unittest.TestSuite(tests))
     test_suite = unittest.TestSuite(suites)
 
     # Now run the tests.
@@ -393,8 +501,40 @@ def test(cases):
     return result
 
 
-def usage():
-    msg="""Usage:\nTestScript.py [options]\nWhere options are:\n
+class _ParallelTestResult:
+    """Minimal stand-in for the unittest result object when the tests
+    are run by pytest in worker processes."""
+    def __init__(self, returncode):
+        self._returncode = returncode
+
+    def wasSuccessful(self):
+        return self._returncode == 0
+
+
+def _testInParallel(cases):
+    """Runs the test modules of the given cases with pytest-xdist using
+    _JOBS worker processes.  Returns None when pytest or the xdist
+    plugin is not available so that the caller can fall back to the
+    serial runner."""
+    try:
+        import pytest
+        import xdist
+    except ImportError:
+        return None
+
+    files = []
+    for case in cases:
+        fname = sys.modules[case[0].__module__].__file__
+        if fname not in files:
+            files.append(fname)
+    returncode = pytest.main(["-n", str(_JOBS), "-p", "no:cacheprovider"]
+                             + files)
+    return _ParallelTestResult(returncode)
+
+
+# built once at import; usage() is called from every command line error
+# path and from -h/--help.
+_USAGE_MSG = """Usage:\nTestScript.py [options]\nWhere options are:\n
 
     -D /path/to/VTKData
     --data-dir /path/to/VTKData
@@ -436,6 +576,13 @@ def usage():
           enabled, the behavior of this is rather trivial and works
           best when the test uses Tkinter.
 
+    -j N
+    --jobs N
+
+          Runs the tests in parallel with N pytest-xdist worker
+          processes when pytest and its xdist plugin are available.
+          The default of 1 uses the serial unittest runner.
+
     -n
     --no-image
 
@@ -449,18 +596,104 @@ def usage():
                  Prints this message.
 
 """
-    return msg
+
+
+def usage():
+    return _USAGE_MSG
+
+
+# The fixed option set, compiled once at import: each token maps to
+# (canonical spelling, takes_argument).  This replaces re-parsing a
+# getopt spec string on every parseCmdLine call.
+_OPT_TABLE = {}
+for _short, _long, _takes_arg in [
+    ('-B', '--baseline-root', 1),
+    ('-D', '--data-dir', 1),
+    ('-T', '--temp-dir', 1),
+    ('-v', '--verbose', 1),
+    ('-j', '--jobs', 1),
+    ('-h', '--help', 0),
+    ('-n', '--no-image', 0),
+    ('-I', '--interact', 0),
+]:
+    _OPT_TABLE[_short] = (_short, _takes_arg)
+    _OPT_TABLE[_long] = (_long, _takes_arg)
+del _short, _long, _takes_arg
+
+
+def _resolveLongOpt(opt):
+    """Looks up a long option, accepting any unique prefix of its full
+    spelling the way getopt does (e.g. --verb for --verbose)."""
+    try:
+        return _OPT_TABLE[opt]
+    except KeyError:
+        matches = [k for k in _OPT_TABLE
+                   if k.startswith('--') and k.startswith(opt)]
+        if len(matches) == 1:
+            return _OPT_TABLE[matches[0]]
+        if matches:
+            raise getopt.error('option %s not a unique prefix'%opt)
+        raise getopt.error('option %s not recognized'%opt)
 
 
 def parseCmdLine():
     arguments = sys.argv[1:]
 
-    options = "B:D:T:v:hnI"
-    long_options = ['baseline-root=', 'data-dir=', 'temp-dir=',
-                    'verbose=', 'help', 'no-image', 'interact']
-
+    opts = []
+    args = []
+    i = 0
+    n = len(arguments)
     try:
-        opts, args = getopt.getopt(arguments, options, long_options)
+        while i < n:
+            arg = arguments[i]
+            i = i + 1
+            if arg == '--':
+                args.extend(arguments[i:])
+                break
+            if arg == '-' or not arg.startswith('-'):
+                # like getopt: option processing stops at the first
+                # non-option argument.
+                args.append(arg)
+                args.extend(arguments[i:])
+                break
+            if arg.startswith('--'):
+                if '=' in arg:
+                    opt, value = arg.split('=', 1)
+                else:
+                    opt, value = arg, None
+                canonical, takes_arg = _resolveLongOpt(opt)
+                if takes_arg:
+                    if value is None:
+                        if i >= n:
+                            raise getopt.error(
+                                'option %s requires argument'%opt)
+                        value = arguments[i]
+                        i = i + 1
+                elif value is not None:
+                    raise getopt.error(
+                        'option %s must not have an argument'%opt)
+                opts.append((canonical, value or ''))
+            else:
+                # a short option cluster, possibly with a glued argument
+                rest = arg[1:]
+                while rest:
+                    opt = '-' + rest[0]
+                    rest = rest[1:]
+                    try:
+                        canonical, takes_arg = _OPT_TABLE[opt]
+                    except KeyError:
+                        raise getopt.error('option %s not recognized'%opt)
+                    value = ''
+                    if takes_arg:
+                        if rest:
+                            value, rest = rest, ''
+                        elif i < n:
+                            value = arguments[i]
+                            i = i + 1
+                        else:
+                            raise getopt.error(
+                                'option %s requires argument'%opt)
+                    opts.append((canonical, value))
     except getopt.error as msg:
         print(usage())
         print('-'*70)
@@ -474,13 +707,13 @@ def processCmdLine():
     opts, args = parseCmdLine()
 
     global VTK_DATA_ROOT, VTK_BASELINE_ROOT, VTK_TEMP_DIR
-    global _VERBOSE, _NO_IMAGE, _INTERACT
+    global _VERBOSE, _NO_IMAGE, _INTERACT, _JOBS
 
     # setup defaults
     try:
         VTK_DATA_ROOT = os.environ['VTK_DATA_ROOT']
     except KeyError:
-        VTK_DATA_ROOT = os.path.normpath("../../../../../VTKData")
+        VTK_DATA_ROOT = _VTK_DATA_ROOT_DEFAULT
 
     try:
         VTK_BASELINE_ROOT = os.environ['VTK_BASELINE_ROOT']
@@ -490,7 +723,7 @@ def processCmdLine():
     try:
         VTK_TEMP_DIR = os.environ['VTK_TEMP_DIR']
     except KeyError:
-        VTK_TEMP_DIR = os.path.normpath("../../../../Testing/Temporary")
+        VTK_TEMP_DIR = _VTK_TEMP_DIR_DEFAULT
 
     for o, a in opts:
         if o in ('-D', '--data-dir'):
@@ -510,6 +743,13 @@ def processCmdLine():
                 msg="Verbosity should be an integer.  0, 1, 2 are valid."
                 print(msg)
                 sys.exit(1)
+        if o in ('-j', '--jobs'):
+            try:
+                _JOBS = int(a)
+            except:
+                msg="The number of jobs should be an integer."
+                print(msg)
+                sys.exit(1)
         if o in ('-h', '--help'):
             print(usage())
             sys.exit()
@@ -517,6 +757,15 @@ def processCmdLine():
     if not VTK_BASELINE_ROOT: # default value.
         VTK_BASELINE_ROOT = VTK_DATA_ROOT
 
+    # Export the resolved configuration so that test processes spawned
+    # by the parallel runner see the same settings; they read these
+    # back in _initFromEnvironment when importing this module.
+    os.environ['VTK_DATA_ROOT'] = VTK_DATA_ROOT
+    os.environ['VTK_BASELINE_ROOT'] = VTK_BASELINE_ROOT
+    os.environ['VTK_TEMP_DIR'] = VTK_TEMP_DIR
+    if _NO_IMAGE:
+        os.environ['VTK_TESTING_NO_IMAGE'] = '1'
+
 
 
 if __name__ == "__main__":